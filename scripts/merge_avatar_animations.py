@@ -5,15 +5,27 @@ Usage:
     blender --background --python scripts/merge_avatar_animations.py
 
 Uses constraint-based animation transfer: imports GLB avatar as target,
-then for each FBX animation adds bone constraints (WORLD space) and bakes.
+appends each FBX animation's skeleton from a cached .blend (converted
+in parallel worker processes when missing or stale), then for each adds
+bone constraints (WORLD space) and bakes.
 Blender's constraint system handles the FBX (Y-up + 90deg X object rotation)
 to GLB (Z-up) coordinate conversion automatically.
 
+Worker mode (used internally to convert an FBX into the cache):
+    blender --background --python scripts/merge_avatar_animations.py -- --worker <fbx> <blend>
+
 Blender 5.0 uses layered actions:
 - action.layers[].strips[].channelbags[].fcurves[]
 """
 
 import bpy
+import hashlib
+import io
+import os
+import subprocess
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Configuration
@@ -21,44 +33,93 @@ PROJECT_ROOT = Path(__file__).parent.parent
 AVATAR_GLB_PATH = PROJECT_ROOT / "assets" / "sample_avatar.glb"
 ANIMATIONS_DIR = PROJECT_ROOT / "avatars_and_animations"
 OUTPUT_PATH = PROJECT_ROOT / "assets" / "sample_avatar_animated.glb"
+ANIMATION_CACHE_DIR = PROJECT_ROOT / "cache" / "animations"
+
+# Print per-file progress; warnings and the final summary are always shown
+VERBOSE = False
+
+# Reuse per-FBX .blend conversions across runs; False imports the FBX
+# files directly in this process
+USE_ANIMATION_CACHE = True
+
+# Bump when the conversion in convert_fbx_to_blend() changes, so cached
+# .blend files from the old code are not reused
+ANIMATION_CACHE_VERSION = 1
 
-SELECTED_ANIMATIONS = [
+# Blender processes used to convert FBX files into the cache in parallel
+PARALLEL_WORKERS = os.cpu_count() or 1
+
+FBX_IMPORT_SETTINGS = {
+    "use_anim": True,
+    "ignore_leaf_bones": True,
+    "automatic_bone_orientation": True,
+}
+
+SELECTED_ANIMATIONS = (
     "Talking.fbx",
     "Idle.fbx",
     "Standing Arguing.fbx",
     "Standing Greeting.fbx",
-]
+)
 
+# Rotation property and array length keyed per bone rotation_mode;
+# every Euler order uses rotation_euler
+ROTATION_CHANNELS = {
+    'QUATERNION': ("rotation_quaternion", 4),
+    'AXIS_ANGLE': ("rotation_axis_angle", 4),
+}
+EULER_CHANNEL = ("rotation_euler", 3)
+
+
+def log(message: str):
+    """Print per-file progress detail when VERBOSE is enabled."""
+    if VERBOSE:
+        print(message)
 
-def get_fcurve_count(action):
-    """Get fcurve count from Blender 5.0 layered action."""
-    count = 0
-    for layer in action.layers:
-        for strip in layer.strips:
-            for cb in strip.channelbags:
-                count += len(cb.fcurves)
-    return count
 
+def find_animation_files():
+    """List FBX files to import from ANIMATIONS_DIR in one directory scan.
 
-def get_keyframe_count(action):
-    """Get keyframe count from first fcurve of Blender 5.0 layered action."""
+    Returns SELECTED_ANIMATIONS that exist (in that order), or every .fbx
+    in the directory when no selection is configured.
+    """
+    try:
+        with os.scandir(ANIMATIONS_DIR) as it:
+            found = {
+                entry.name: Path(entry.path)
+                for entry in it
+                if entry.name.endswith(".fbx") and entry.is_file()
+            }
+    except FileNotFoundError:
+        return []
+
+    if SELECTED_ANIMATIONS:
+        return [found[name] for name in SELECTED_ANIMATIONS if name in found]
+    return [found[name] for name in sorted(found)]
+
+
+def get_action_stats(action):
+    """Get (fcurve count, first-fcurve keyframe count) from a Blender 5.0
+    layered action in a single traversal.
+    """
+    fcurve_count = 0
+    keyframe_count = 0
     for layer in action.layers:
         for strip in layer.strips:
             for cb in strip.channelbags:
-                if cb.fcurves:
-                    return len(cb.fcurves[0].keyframe_points)
-    return 0
+                fcurves = cb.fcurves
+                if fcurves and not fcurve_count:
+                    keyframe_count = len(fcurves[0].keyframe_points)
+                fcurve_count += len(fcurves)
+    return fcurve_count, keyframe_count
 
 
 def clear_scene():
     """Remove all objects from scene."""
-    bpy.ops.object.select_all(action='SELECT')
-    bpy.ops.object.delete(use_global=False)
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
 
-    for collection in [bpy.data.meshes, bpy.data.armatures, bpy.data.actions]:
-        for block in list(collection):
-            if block.users == 0:
-                collection.remove(block)
+    bpy.data.orphans_purge(do_recursive=True)
 
 
 def import_glb_avatar(glb_path: Path):
@@ -67,7 +128,7 @@ def import_glb_avatar(glb_path: Path):
     Strips any pre-existing animations (e.g. Avaturn's blink animation)
     and resets shape key values to 0 so our animations start from a clean state.
     """
-    print(f"Importing GLB avatar: {glb_path}")
+    log(f"Importing GLB avatar: {glb_path}")
     bpy.ops.import_scene.gltf(filepath=str(glb_path))
 
     armature = None
@@ -80,28 +141,24 @@ def import_glb_avatar(glb_path: Path):
         raise RuntimeError("No armature found in GLB avatar!")
 
     bone_count = len(armature.data.bones)
-    mesh_count = len([c for c in armature.children if c.type == 'MESH'])
-    morph_count = sum(
-        len(c.data.shape_keys.key_blocks) if c.data.shape_keys else 0
-        for c in armature.children if c.type == 'MESH'
-    )
-    print(f"Found armature: {armature.name} ({bone_count} bones, {mesh_count} meshes, {morph_count} morph targets)")
+    meshes = [c for c in armature.children if c.type == 'MESH']
+    morph_meshes = [m for m in meshes if m.data.shape_keys]
+    morph_count = sum(len(m.data.shape_keys.key_blocks) for m in morph_meshes)
+    log(f"Found armature: {armature.name} ({bone_count} bones, {len(meshes)} meshes, {morph_count} morph targets)")
 
     # Strip pre-existing animations (Avaturn includes a blink/idle animation
     # that sets eyeBlinkLeft/Right shape keys, causing closed eyes)
     if armature.animation_data:
         for track in list(armature.animation_data.nla_tracks):
-            print(f"  Removing pre-existing NLA track: {track.name}")
+            log(f"  Removing pre-existing NLA track: {track.name}")
             armature.animation_data.nla_tracks.remove(track)
         if armature.animation_data.action:
-            print(f"  Removing pre-existing action: {armature.animation_data.action.name}")
+            log(f"  Removing pre-existing action: {armature.animation_data.action.name}")
             armature.animation_data.action = None
 
     # Reset all shape key values to 0 (Avaturn bakes default expression values
     # like eyeBlinkLeft=0.45 into the GLB, causing half-closed eyes)
-    for child in armature.children:
-        if child.type != 'MESH' or not child.data.shape_keys:
-            continue
+    for child in morph_meshes:
         reset_count = 0
         for kb in child.data.shape_keys.key_blocks:
             if kb.name == "Basis":
@@ -110,39 +167,273 @@ def import_glb_avatar(glb_path: Path):
                 kb.value = 0.0
                 reset_count += 1
         if reset_count > 0:
-            print(f"  Reset {reset_count} shape keys on {child.name}")
+            log(f"  Reset {reset_count} shape keys on {child.name}")
 
     return armature
 
 
-def import_and_transfer_animation(fbx_path: Path, target_armature):
-    """Import FBX animation and transfer to target via bone constraints.
+def import_fbx_sources(fbx_files):
+    """Import FBX animations in-process, one file at a time.
 
-    Uses Blender's constraint system to handle coordinate space conversion:
-    - Copy Rotation (WORLD -> WORLD) on all matching bones
-    - Copy Location (WORLD -> WORLD) on Hips only
-    - Bake with visual_keying to capture constraint-evaluated poses
+    Each file's armature is identified from the objects that import added
+    (not by name), so every armature maps back to its own file. Files
+    without an armature are skipped with a warning.
+
+    Returns a list of (fbx_path, source_armature) pairs.
     """
-    animation_name = fbx_path.stem.replace(" ", "_").replace("-", "_")
-    print(f"\nImporting animation: {fbx_path.name} -> {animation_name}")
+    sources = []
+    for fbx_path in fbx_files:
+        log(f"\nImporting FBX: {fbx_path.name}")
+        existing = set(bpy.data.objects)
+        bpy.ops.import_scene.fbx(
+            filepath=str(fbx_path),
+            **FBX_IMPORT_SETTINGS,
+        )
+
+        new_objects = [obj for obj in bpy.data.objects if obj not in existing]
+        armature = next((obj for obj in new_objects if obj.type == 'ARMATURE'), None)
+
+        # Only the source skeleton is needed as a constraint target. Drop the
+        # Mixamo meshes here, which also keeps them out of the per-frame
+        # evaluation while baking.
+        for obj in new_objects:
+            if obj != armature:
+                bpy.data.objects.remove(obj, do_unlink=True)
+
+        if not armature:
+            print(f"  Warning: No armature in {fbx_path.name}, skipping")
+            continue
 
-    # Import FBX animation as source
+        sources.append((fbx_path, armature))
+
+    return sources
+
+
+def convert_fbx_to_blend(fbx_path: Path, blend_path: Path):
+    """Worker mode: import one FBX and write its armature + action to a .blend.
+
+    Mixamo meshes are not written; only the skeleton is needed as a
+    constraint target, and its action is saved as a dependency.
+    """
+    clear_scene()
     bpy.ops.import_scene.fbx(
         filepath=str(fbx_path),
-        use_anim=True,
-        ignore_leaf_bones=True,
-        automatic_bone_orientation=True,
+        **FBX_IMPORT_SETTINGS,
     )
 
-    source_armature = None
+    armature = None
     for obj in bpy.context.selected_objects:
-        if obj.type == 'ARMATURE' and obj != target_armature:
-            source_armature = obj
+        if obj.type == 'ARMATURE':
+            armature = obj
             break
 
-    if not source_armature:
-        print(f"  Warning: No armature in {fbx_path.name}, skipping")
-        return None
+    if not armature:
+        raise RuntimeError(f"No armature found in {fbx_path.name}!")
+
+    bpy.data.libraries.write(str(blend_path), {armature})
+
+
+def _run_worker(fbx_path: Path, blend_path: Path):
+    """Convert one FBX in a separate background Blender process.
+
+    Returns None on success, or the worker's error output on failure.
+    """
+    result = subprocess.run(
+        [
+            bpy.app.binary_path,
+            "--background",
+            "--factory-startup",
+            "--python-exit-code", "1",
+            "--python", __file__,
+            "--", "--worker", str(fbx_path), str(blend_path),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return result.stderr.strip() or f"exit code {result.returncode}"
+    return None
+
+
+def append_source_armature(blend_path: Path):
+    """Append the armature (and its action) written by a worker into the scene.
+
+    Returns None if the file holds no armature object.
+    """
+    with bpy.data.libraries.load(str(blend_path), link=False) as (data_from, data_to):
+        data_to.objects = list(data_from.objects)
+
+    armature = None
+    for obj in data_to.objects:
+        if obj is None:
+            continue
+        if obj.type == 'ARMATURE' and armature is None:
+            armature = obj
+        else:
+            bpy.data.objects.remove(obj, do_unlink=True)
+
+    if armature:
+        bpy.context.scene.collection.objects.link(armature)
+    return armature
+
+
+def _cache_key():
+    """Key identifying the conversion code, Blender version and FBX import
+    settings, so cached .blend files are rebuilt when any of them changes.
+    """
+    key = repr((
+        ANIMATION_CACHE_VERSION,
+        bpy.app.version_string,
+        sorted(FBX_IMPORT_SETTINGS.items()),
+    ))
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def _is_stale(fbx_path: Path, blend_path: Path):
+    """Whether blend_path is missing or older than fbx_path (one stat each)."""
+    try:
+        blend_mtime = blend_path.stat().st_mtime
+    except FileNotFoundError:
+        return True
+    return blend_mtime < fbx_path.stat().st_mtime
+
+
+def import_fbx_sources_cached(fbx_files):
+    """Append source armatures from cached .blend conversions of each FBX.
+
+    FBX parsing dominates import time, so each file is converted once (in
+    parallel worker processes) to a minimal .blend and only re-converted
+    when the FBX is newer than its cache. Threads are enough to drive the
+    workers since the work happens in child processes.
+
+    Returns a list of (fbx_path, source_armature) pairs.
+    """
+    cache_dir = ANIMATION_CACHE_DIR / _cache_key()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    blend_paths = [cache_dir / f"{p.stem}.blend" for p in fbx_files]
+
+    stale = [
+        (fbx_path, blend_path)
+        for fbx_path, blend_path in zip(fbx_files, blend_paths)
+        if _is_stale(fbx_path, blend_path)
+    ]
+    log(f"\nUsing {len(fbx_files) - len(stale)} cached animations, converting {len(stale)}")
+
+    failed = set()
+    if stale:
+        with ThreadPoolExecutor(max_workers=PARALLEL_WORKERS) as pool:
+            errors = pool.map(_run_worker, *zip(*stale))
+            for (fbx_path, _), error in zip(stale, errors):
+                if error:
+                    print(f"  Warning: Could not convert {fbx_path.name}, skipping:\n{error}")
+                    failed.add(fbx_path)
+
+    sources = []
+    for fbx_path, blend_path in zip(fbx_files, blend_paths):
+        if fbx_path in failed:
+            continue
+        armature = append_source_armature(blend_path)
+        if not armature:
+            print(f"  Warning: No armature in {fbx_path.name}, skipping")
+            continue
+        sources.append((fbx_path, armature))
+
+    return sources
+
+
+def bake_pose_action(armature, pose_bones, frame_start: int, frame_end: int):
+    """Bake constraint-evaluated poses of pose_bones into a new action.
+
+    Equivalent to bpy.ops.nla.bake(visual_keying=True, bake_types={'POSE'}),
+    but samples every frame into flat (frame, value) buffers and bulk-loads
+    each fcurve with keyframe_points.foreach_set() instead of calling
+    keyframe_insert per bone per frame. Rotation is keyed on the property
+    matching each bone's rotation_mode.
+
+    Unlike the operator with only_selected=False, only the given bones are
+    keyed; bones without a source counterpart keep their current pose and
+    get no fcurves.
+    """
+    scene = bpy.context.scene
+    frame_count = frame_end - frame_start + 1
+
+    # Per bone: its rotation mode, keyed channels and one
+    # [frame, value, frame, value, ...] buffer per fcurve
+    samples = []
+    for pose_bone in pose_bones:
+        mode = pose_bone.rotation_mode
+        channels = (("location", 3), ROTATION_CHANNELS.get(mode, EULER_CHANNEL), ("scale", 3))
+        buffers = [
+            array('f', [0.0]) * (2 * frame_count)
+            for _ in range(sum(length for _, length in channels))
+        ]
+        samples.append((pose_bone, mode, channels, buffers))
+    prev_rotations = {}
+
+    for i, frame in enumerate(range(frame_start, frame_end + 1)):
+        scene.frame_set(frame)
+        j = 2 * i
+        for pose_bone, mode, _, buffers in samples:
+            # Visual keying: constrained pose matrix back to bone-local space
+            matrix = armature.convert_space(
+                pose_bone=pose_bone,
+                matrix=pose_bone.matrix,
+                from_space='POSE',
+                to_space='LOCAL',
+            )
+            loc, quat, scale = matrix.decompose()
+
+            # Keep rotations continuous with the previous frame to avoid flips
+            prev = prev_rotations.get(pose_bone.name)
+            if mode == 'QUATERNION':
+                if prev is not None:
+                    quat.make_compatible(prev)
+                rotation = prev_rotations[pose_bone.name] = quat
+            elif mode == 'AXIS_ANGLE':
+                axis, angle = quat.to_axis_angle()
+                rotation = (angle, *axis)
+            else:
+                euler = quat.to_euler(mode, prev) if prev is not None else quat.to_euler(mode)
+                rotation = prev_rotations[pose_bone.name] = euler
+
+            for buffer, value in zip(buffers, (*loc, *rotation, *scale)):
+                buffer[j] = frame
+                buffer[j + 1] = value
+
+    action = bpy.data.actions.new("Baked")
+    armature.animation_data.action = action
+
+    for pose_bone, _, channels, buffers in samples:
+        bone_path = f'pose.bones["{bpy.utils.escape_identifier(pose_bone.name)}"]'
+        buffer_iter = iter(buffers)
+        for prop, length in channels:
+            for index in range(length):
+                fcurve = action.fcurve_ensure_for_datablock(
+                    armature,
+                    f"{bone_path}.{prop}",
+                    index=index,
+                    group_name=pose_bone.name,
+                )
+                fcurve.keyframe_points.add(frame_count)
+                fcurve.keyframe_points.foreach_set("co", next(buffer_iter))
+                fcurve.update()
+
+    return action
+
+
+def transfer_animation(fbx_path: Path, source_armature, target_armature, nla_tracks):
+    """Transfer an imported FBX animation to target via bone constraints.
+
+    Uses Blender's constraint system to handle coordinate space conversion:
+    - Copy Rotation (WORLD -> WORLD) on all matching bones
+    - Copy Location (WORLD -> WORLD) on Hips only
+    - Bake with visual_keying to capture constraint-evaluated poses
+
+    nla_tracks is the target's NLA track collection, resolved once by the
+    caller rather than per animation.
+    """
+    animation_name = fbx_path.stem.replace(" ", "_").replace("-", "_")
+    log(f"\nTransferring animation: {fbx_path.name} -> {animation_name}")
 
     if not source_armature.animation_data or not source_armature.animation_data.action:
         print(f"  Warning: No animation data in {fbx_path.name}, skipping")
@@ -152,108 +443,90 @@ def import_and_transfer_animation(fbx_path: Path, target_armature):
     source_action = source_armature.animation_data.action
     frame_start = int(source_action.frame_range[0])
     frame_end = int(source_action.frame_range[1])
-    print(f"  Source: {source_armature.name}, frames {frame_start}-{frame_end}")
+    log(f"  Source: {source_armature.name}, frames {frame_start}-{frame_end}")
 
     # Add constraints from target bones to source bones
-    bpy.ops.object.select_all(action='DESELECT')
-    target_armature.select_set(True)
-    bpy.context.view_layer.objects.active = target_armature
-    bpy.ops.object.mode_set(mode='POSE')
-
+    # Materialize RNA collections once; match bones by name
     source_bone_names = {b.name for b in source_armature.data.bones}
-    constrained_count = 0
+    constrained_bones = []
+    added_constraints = []
 
-    for pose_bone in target_armature.pose.bones:
-        if pose_bone.name not in source_bone_names:
+    for pose_bone in list(target_armature.pose.bones):
+        bone_name = pose_bone.name
+        if bone_name not in source_bone_names:
             continue
 
-        # Copy Rotation in world space
-        c_rot = pose_bone.constraints.new('COPY_ROTATION')
-        c_rot.target = source_armature
-        c_rot.subtarget = pose_bone.name
-        c_rot.target_space = 'WORLD'
-        c_rot.owner_space = 'WORLD'
-
-        # Copy Location only on root bone (Hips)
-        if pose_bone.name == "Hips":
-            c_loc = pose_bone.constraints.new('COPY_LOCATION')
-            c_loc.target = source_armature
-            c_loc.subtarget = pose_bone.name
-            c_loc.target_space = 'WORLD'
-            c_loc.owner_space = 'WORLD'
-
-        constrained_count += 1
-
-    print(f"  Constrained {constrained_count} bones")
-
-    # Bake the constrained animation onto target
-    bpy.context.scene.frame_set(frame_start)
-    source_armature.animation_data.action = source_action
-
-    bpy.ops.nla.bake(
-        frame_start=frame_start,
-        frame_end=frame_end,
-        only_selected=False,
-        visual_keying=True,
-        clear_constraints=True,
-        bake_types={'POSE'},
-    )
+        # Copy Rotation in world space, plus Copy Location only on the
+        # root bone (Hips)
+        types = ('COPY_ROTATION', 'COPY_LOCATION') if bone_name == "Hips" else ('COPY_ROTATION',)
+        for constraint_type in types:
+            constraint = pose_bone.constraints.new(constraint_type)
+            constraint.target = source_armature
+            constraint.subtarget = bone_name
+            constraint.target_space = 'WORLD'
+            constraint.owner_space = 'WORLD'
+            added_constraints.append((pose_bone, constraint))
 
-    # Name and stash the baked action
-    baked_action = target_armature.animation_data.action
-    if not baked_action:
-        print(f"  Warning: Bake produced no action for {fbx_path.name}")
-        bpy.ops.object.mode_set(mode='OBJECT')
+        constrained_bones.append(pose_bone)
+
+    log(f"  Constrained {len(constrained_bones)} bones")
+
+    if not constrained_bones:
+        print(f"  Warning: No matching bones in {fbx_path.name}, skipping")
         bpy.data.objects.remove(source_armature, do_unlink=True)
         return None
 
+    # Bake the constrained animation onto target (the bake sets each frame)
+    baked_action = bake_pose_action(
+        target_armature, constrained_bones, frame_start, frame_end,
+    )
+
+    for pose_bone, constraint in added_constraints:
+        pose_bone.constraints.remove(constraint)
+
+    # Name and stash the baked action
     baked_action.name = animation_name
-    fcurve_count = get_fcurve_count(baked_action)
-    keyframe_count = get_keyframe_count(baked_action)
-    print(f"  Baked: {fcurve_count} fcurves, {keyframe_count} keyframes")
+    fcurve_count, keyframe_count = get_action_stats(baked_action)
+    log(f"  Baked: {fcurve_count} fcurves, {keyframe_count} keyframes")
 
-    # Stash in NLA track
-    track = target_armature.animation_data.nla_tracks.new()
+    # Stash in its own NLA track: the glTF exporter (ACTIONS mode) only
+    # collects actions from tracks holding a single strip
+    track = nla_tracks.new()
     track.name = animation_name
     track.strips.new(animation_name, frame_start, baked_action)
     target_armature.animation_data.action = None
-    print(f"  Stashed in NLA track: {track.name}")
-
-    bpy.ops.object.mode_set(mode='OBJECT')
+    log(f"  Stashed in NLA track: {track.name}")
 
-    # Clean up source armature and its children
-    for child in list(source_armature.children):
-        bpy.data.objects.remove(child, do_unlink=True)
+    # Clean up source armature (its meshes were removed after import)
     bpy.data.objects.remove(source_armature, do_unlink=True)
 
     return baked_action
 
 
-def verify_animations(armature):
-    """Verify all animations are properly set up for export."""
-    print("\n=== VERIFICATION ===")
+def verify_animations(armature, out):
+    """Verify all animations are properly set up for export, reporting to out."""
+    print("\n=== VERIFICATION ===", file=out)
 
     if not armature.animation_data:
-        print("ERROR: No animation data on armature!")
+        print("ERROR: No animation data on armature!", file=out)
         return False
 
     nla_tracks = armature.animation_data.nla_tracks
-    print(f"NLA tracks: {len(nla_tracks)}")
+    print(f"NLA tracks: {len(nla_tracks)}", file=out)
 
     all_good = True
     for track in nla_tracks:
-        print(f"\nTrack: {track.name}")
+        print(f"\nTrack: {track.name}", file=out)
         for strip in track.strips:
             action = strip.action
             if action:
-                kf_count = get_keyframe_count(action)
-                fc_count = get_fcurve_count(action)
-                print(f"  Strip: {strip.name}, fcurves: {fc_count}, keyframes: {kf_count}")
+                fc_count, kf_count = get_action_stats(action)
+                print(f"  Strip: {strip.name}, fcurves: {fc_count}, keyframes: {kf_count}", file=out)
                 if kf_count <= 2:
-                    print(f"  WARNING: Only {kf_count} keyframes - animation may be empty!")
+                    print(f"  WARNING: Only {kf_count} keyframes - animation may be empty!", file=out)
                     all_good = False
             else:
-                print(f"  Strip: {strip.name}, NO ACTION!")
+                print(f"  Strip: {strip.name}, NO ACTION!", file=out)
                 all_good = False
 
     return all_good
@@ -261,30 +534,33 @@ def verify_animations(armature):
 
 def export_glb(output_path: Path, armature):
     """Export as GLB with animations and morph targets."""
-    print(f"\n=== EXPORTING TO {output_path} ===")
-
-    bpy.ops.object.select_all(action='DESELECT')
-    armature.select_set(True)
-    for child in armature.children:
-        child.select_set(True)
-    bpy.context.view_layer.objects.active = armature
-
-    bpy.ops.export_scene.gltf(
-        filepath=str(output_path),
-        export_format='GLB',
-        export_animations=True,
-        export_animation_mode='ACTIONS',
-        export_nla_strips=True,
-        export_force_sampling=True,
-        export_bake_animation=True,
-        export_skins=True,
-        export_morph=True,
-        export_texcoords=True,
-        export_normals=True,
-        use_selection=True,
-    )
-
-    print(f"Exported to: {output_path}")
+    log(f"\n=== EXPORTING TO {output_path} ===")
+
+    export_objects = [armature, *armature.children]
+
+    # The glTF exporter reads each object's select_get() for use_selection,
+    # so set the flags directly (no select_all operator) and provide the
+    # matching context through temp_override.
+    export_set = set(export_objects)
+    for obj in bpy.context.view_layer.objects:
+        obj.select_set(obj in export_set)
+
+    with bpy.context.temp_override(
+        active_object=armature,
+        selected_objects=export_objects,
+        selected_editable_objects=export_objects,
+    ):
+        bpy.ops.export_scene.gltf(
+            filepath=str(output_path),
+            export_format='GLB',
+            export_animations=True,
+            export_animation_mode='ACTIONS',
+            export_nla_strips=True,
+            export_force_sampling=True,
+            export_skins=True,
+            export_morph=True,
+            use_selection=True,
+        )
 
 
 def main():
@@ -298,27 +574,43 @@ def main():
     armature = import_glb_avatar(AVATAR_GLB_PATH)
 
     # Step 2: Import and transfer each animation via constraints
-    if SELECTED_ANIMATIONS:
-        fbx_files = [ANIMATIONS_DIR / name for name in SELECTED_ANIMATIONS]
-        fbx_files = [f for f in fbx_files if f.exists()]
-    else:
-        fbx_files = list(ANIMATIONS_DIR.glob("*.fbx"))
+    fbx_files = find_animation_files()
 
     print(f"\nFound {len(fbx_files)} animation files to import")
 
+    # Resolve loop invariants once instead of per animation
+    armature.animation_data_create()
+    nla_tracks = armature.animation_data.nla_tracks
+
     imported_count = 0
-    for fbx_path in fbx_files:
-        action = import_and_transfer_animation(fbx_path, armature)
+    if not fbx_files:
+        sources = []
+    elif USE_ANIMATION_CACHE:
+        sources = import_fbx_sources_cached(fbx_files)
+    else:
+        sources = import_fbx_sources(fbx_files)
+    for fbx_path, source_armature in sources:
+        action = transfer_animation(fbx_path, source_armature, armature, nla_tracks)
         if action:
             imported_count += 1
 
-    print(f"\nSuccessfully transferred {imported_count} animations")
+    # Single view layer update after all bulk mutations
+    bpy.context.view_layer.update()
+
+    # Collect the verification summary and write it with a single flush,
+    # before exporting so it is shown even if the export fails
+    summary = io.StringIO()
+    print(f"\nSuccessfully transferred {imported_count} animations", file=summary)
 
     # Step 3: Verify and export
-    if not verify_animations(armature):
-        print("\nWARNING: Some animations may not export correctly!")
+    if not verify_animations(armature, summary):
+        print("\nWARNING: Some animations may not export correctly!", file=summary)
+
+    sys.stdout.write(summary.getvalue())
+    sys.stdout.flush()
 
     export_glb(OUTPUT_PATH, armature)
+    print(f"\nExported to: {OUTPUT_PATH}")
 
     print("\n" + "=" * 60)
     print("DONE!")
@@ -326,4 +618,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    if argv[:1] == ["--worker"]:
+        convert_fbx_to_blend(Path(argv[1]), Path(argv[2]))
+    else:
+        main()